@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Callable, Hashable
+
+from telegram.ext import Application
+
+MAX_SIZE = 10_000
+IDLE_TTL = 24 * 60 * 60
+
+
+class BoundedStore(OrderedDict):
+    """Аналог defaultdict, который хранит не больше max_size записей и
+    вытесняет те, к которым не обращались дольше ttl секунд"""
+
+    def __init__(
+        self,
+        default_factory: Callable[[], object],
+        max_size: int = MAX_SIZE,
+        ttl: float = IDLE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self.default_factory = default_factory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._last_access: dict[Hashable, float] = {}
+
+    def __missing__(self, key):
+        value = self.default_factory()
+        self[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self._touch(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._touch(key)
+        self._evict()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._last_access.pop(key, None)
+
+    def pop(self, key, *args):
+        self._last_access.pop(key, None)
+        return super().pop(key, *args)
+
+    def _touch(self, key) -> None:
+        self.move_to_end(key)
+        self._last_access[key] = self.clock()
+
+    def _evict(self) -> None:
+        deadline = self.clock() - self.ttl
+        while self:
+            oldest = next(iter(self))
+            if len(self) <= self.max_size and self._last_access[oldest] > deadline:
+                break
+            self.pop(oldest)
+
+
+class BoundedApplication(Application):
+    """Application, у которого user_data и chat_data не растут бесконечно"""
+
+    def __init__(self, max_size: int = MAX_SIZE, ttl: float = IDLE_TTL, **kwargs):
+        super().__init__(**kwargs)
+        self._user_data = BoundedStore(self.context_types.user_data, max_size, ttl)
+        self._chat_data = BoundedStore(self.context_types.chat_data, max_size, ttl)
+        self.user_data = MappingProxyType(self._user_data)
+        self.chat_data = MappingProxyType(self._chat_data)
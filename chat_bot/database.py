@@ -1,7 +1,19 @@
 from typing import Optional, Literal
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy import Column, Integer, ForeignKey, select, Index, String, update
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    ForeignKey,
+    select,
+    Index,
+    String,
+    update,
+    delete,
+    func,
+)
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -38,6 +50,15 @@ class Config(Base):
     text_value = Column(String)
 
 
+class JournalEntry(Base):
+    __tablename__ = "journal"
+    update_id = Column(Integer, primary_key=True, autoincrement=False)
+    payload = Column(String, nullable=False)
+    processed = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (Index("idx_journal_processed", processed),)
+
+
 DATABASE_URL = "sqlite+aiosqlite:///my_database.sqlite"
 engine = create_async_engine(DATABASE_URL, echo=True)
 
@@ -70,16 +91,48 @@ async def create_user(user_id: int, message_thread_id: int) -> int:
 async def delete_user(user_id: int) -> None:
     async with AsyncSession(engine) as session:
         user = await session.get(User, user_id)
+        if user is None:
+            return
         await session.delete(user)
         await session.commit()
 
 
+async def delete_user_if_thread_matches(user_id: int, message_thread_id: int) -> bool:
+    """Удаляет пользователя, только если он всё ещё привязан к message_thread_id.
+    Возвращает, был ли пользователь удалён"""
+    async with AsyncSession(engine) as session:
+        async with session.begin():
+            result = await session.execute(
+                delete(User).where(
+                    (User.id == user_id) & (User.message_thread_id == message_thread_id)
+                )
+            )
+        return result.rowcount > 0
+
+
+async def find_users_page(
+    after_user_id: Optional[int] = None, limit: int = 100
+) -> list[tuple[int, int]]:
+    """Возвращает пары (id, message_thread_id) по возрастанию id, начиная
+    после after_user_id"""
+    async with AsyncSession(engine) as session:
+        query = select(User.id, User.message_thread_id).order_by(User.id).limit(limit)
+        if after_user_id is not None:
+            query = query.where(User.id > after_user_id)
+        result = await session.execute(query)
+        return [tuple(row) for row in result.all()]
+
+
 async def create_message(
     user_id: int,
     message_id: int,
     chat_message_id: int,
     sender_type: Literal["user", "staff"],
+    update_id: Optional[int] = None,
 ) -> int:
+    """Сохраняет сообщение. Если передан update_id, в той же транзакции
+    помечает апдейт в журнале обработанным, чтобы при повторе он не создал
+    дубликат"""
     async with AsyncSession(engine) as session:
         message = Message(
             user_id=user_id,
@@ -88,6 +141,12 @@ async def create_message(
             sender_type=sender_type,
         )
         session.add(message)
+        if update_id is not None:
+            await session.execute(
+                update(JournalEntry)
+                .where(JournalEntry.update_id == update_id)
+                .values(processed=True)
+            )
         await session.commit()
         await session.refresh(message)
         return message.id
@@ -149,6 +208,66 @@ async def update_text(new_value: str):
             await session.commit()
 
 
+async def append_to_journal(entries: list[tuple[int, str]]) -> None:
+    """Записывает апдейты в журнал. Уже записанные update_id игнорируются"""
+    if not entries:
+        return
+    async with AsyncSession(engine) as session:
+        await session.execute(
+            insert(JournalEntry)
+            .values(
+                [
+                    {"update_id": update_id, "payload": payload, "processed": False}
+                    for update_id, payload in entries
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=[JournalEntry.update_id])
+        )
+        await session.commit()
+
+
+async def find_pending_journal_entries(limit: int = 100) -> list[tuple[int, str]]:
+    async with AsyncSession(engine) as session:
+        result = await session.execute(
+            select(JournalEntry.update_id, JournalEntry.payload)
+            .where(JournalEntry.processed.is_(False))
+            .order_by(JournalEntry.update_id)
+            .limit(limit)
+        )
+        return [tuple(row) for row in result.all()]
+
+
+async def mark_journal_entry_processed(update_id: int) -> None:
+    async with AsyncSession(engine) as session:
+        async with session.begin():
+            await session.execute(
+                update(JournalEntry)
+                .where(JournalEntry.update_id == update_id)
+                .values(processed=True)
+            )
+
+
+async def find_last_journal_update_id() -> Optional[int]:
+    async with AsyncSession(engine) as session:
+        result = await session.execute(select(func.max(JournalEntry.update_id)))
+        return result.scalar_one_or_none()
+
+
+async def prune_journal() -> None:
+    """Удаляет обработанные записи, оставляя последнюю для восстановления offset"""
+    last_update_id = await find_last_journal_update_id()
+    if last_update_id is None:
+        return
+    async with AsyncSession(engine) as session:
+        async with session.begin():
+            await session.execute(
+                delete(JournalEntry).where(
+                    JournalEntry.processed.is_(True)
+                    & (JournalEntry.update_id < last_update_id)
+                )
+            )
+
+
 async def drop_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
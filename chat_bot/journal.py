@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import signal
+from typing import Callable, Coroutine
+
+from telegram import Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application
+
+from chat_bot import database, tracing
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 10
+POLL_ERROR_DELAY = 5
+BATCH_SIZE = 100
+RESTART_DELAY = 5
+
+
+async def poll_updates(application: Application, new_updates: asyncio.Event) -> None:
+    """Забирает апдейты у Telegram и пишет их в журнал.
+
+    Следующий getUpdates со сдвинутым offset (то есть подтверждение апдейтов)
+    отправляется только после того, как апдейты сохранены в журнале
+    """
+    last_update_id = await database.find_last_journal_update_id()
+    offset = last_update_id + 1 if last_update_id is not None else None
+    while True:
+        try:
+            updates = await application.bot.get_updates(
+                offset=offset,
+                timeout=POLL_TIMEOUT,
+                # Как в run_polling: набор апдейтов по умолчанию у Telegram
+                allowed_updates=None,
+            )
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramError as e:
+            logger.warning("getUpdates failed: %s", e)
+            await asyncio.sleep(POLL_ERROR_DELAY)
+            continue
+        if not updates:
+            continue
+        await database.append_to_journal(
+            [
+                (update.update_id, json.dumps(update.to_dict(), ensure_ascii=False))
+                for update in updates
+            ]
+        )
+        offset = updates[-1].update_id + 1
+        new_updates.set()
+
+
+async def process_journal(
+    application: Application,
+    new_updates: asyncio.Event,
+    stop: asyncio.Event,
+    slow_update_threshold: float = tracing.SLOW_UPDATE_THRESHOLD,
+) -> None:
+    """Обрабатывает необработанные записи журнала по порядку update_id.
+
+    При старте сначала доигрывает то, что осталось с прошлого запуска.
+    Когда выставлен stop, дообрабатывает текущий апдейт и завершается
+    """
+    while not stop.is_set():
+        new_updates.clear()
+        entries = await database.find_pending_journal_entries(limit=BATCH_SIZE)
+        for update_id, payload in entries:
+            update = Update.de_json(json.loads(payload), application.bot)
+            try:
+                with tracing.trace_update(update_id, slow_update_threshold):
+                    await application.process_update(update)
+            except Exception:
+                logger.exception("Failed to process update %s", update_id)
+            await database.mark_journal_entry_processed(update_id)
+            if stop.is_set():
+                return
+        if entries:
+            await database.prune_journal()
+        if len(entries) < BATCH_SIZE:
+            await new_updates.wait()
+
+
+async def supervise(name: str, task: Callable[[], Coroutine]) -> None:
+    """Запускает task и перезапускает его, если он упал с исключением"""
+    while True:
+        try:
+            await task()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("%s crashed, restarting", name)
+            await asyncio.sleep(RESTART_DELAY)
+
+
+async def run(
+    application: Application,
+    *background: Callable[[], Coroutine],
+    slow_update_threshold: float = tracing.SLOW_UPDATE_THRESHOLD,
+) -> None:
+    """Аналог Application.run_polling, в котором получение апдейтов и их
+    обработка развязаны через журнал в базе данных. background - функции,
+    которые запускают фоновые задачи, работающие вместе с приложением.
+
+    По SIGINT/SIGTERM дообрабатывает текущий апдейт и корректно
+    останавливает приложение
+    """
+    new_updates = asyncio.Event()
+    stop = asyncio.Event()
+
+    def request_stop() -> None:
+        stop.set()
+        new_updates.set()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, request_stop)
+    try:
+        async with application:
+            await application.start()
+            tasks = [
+                asyncio.create_task(
+                    supervise(
+                        "poll_updates", lambda: poll_updates(application, new_updates)
+                    )
+                ),
+                *(
+                    asyncio.create_task(
+                        supervise(getattr(task, "__name__", repr(task)), task)
+                    )
+                    for task in background
+                ),
+            ]
+            try:
+                await supervise(
+                    "process_journal",
+                    lambda: process_journal(
+                        application, new_updates, stop, slow_update_threshold
+                    ),
+                )
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await application.stop()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
@@ -1,7 +1,9 @@
 import asyncio
+import functools
 import logging
 import json
 import sys
+import time
 from typing import Optional
 
 import jsonschema
@@ -25,7 +27,8 @@ from telegram.ext import (
     CallbackQueryHandler,
 )
 
-from chat_bot import database
+from chat_bot import database, journal, profiler, topics, tracing
+from chat_bot.context_store import BoundedApplication
 from chat_bot.error_handler import error_handler
 from chat_bot.exceptions import NoAdminChat, NoTopicsAdminChat, NoTopicRightsAdminChat
 
@@ -54,6 +57,7 @@ def validate_json(json_data):
             "DEVELOPER_CHAT_ID": {"type": "integer"},
             "ADMIN_LIST": {"type": "array", "items": {"type": "string"}},
             "PROMPT": {"type": "array", "items": {"type": "string"}},
+            "SLOW_UPDATE_THRESHOLD": {"type": "number"},
         },
         "required": ["ADMIN_CHAT_ID", "DEVELOPER_CHAT_ID", "ADMIN_LIST", "PROMPT"],
     }
@@ -71,13 +75,20 @@ logger = logging.getLogger(__name__)
 ADMIN_CHAT_ID = int(config["ADMIN_CHAT_ID"])
 DEVELOPER_CHAT_ID = int(config["DEVELOPER_CHAT_ID"])
 ADMIN_LIST = config["ADMIN_LIST"]
+THREAD_NOT_FOUND_RETRIES = 2
+SLOW_UPDATE_THRESHOLD = float(
+    config.get("SLOW_UPDATE_THRESHOLD", tracing.SLOW_UPDATE_THRESHOLD)
+)
+PROFILE_DURATION = 10
 
 
+@tracing.traced
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Посылает приветственный текст"""
     await update.message.reply_text(await database.get_text())
 
 
+@tracing.traced
 async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Посылает приветственный текст"""
     await update.message.reply_text(
@@ -90,6 +101,7 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@tracing.traced
 async def set_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обновляет приветственный текст"""
     if update.effective_user.username not in ADMIN_LIST:
@@ -108,6 +120,40 @@ async def set_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(await database.get_text())
 
 
+@tracing.traced
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запускает профилирование event loop, результат придёт в чат разработчика"""
+    if update.effective_user.username not in ADMIN_LIST:
+        return
+    duration = PROFILE_DURATION
+    if context.args:
+        try:
+            duration = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("Использование: /profile [секунды]")
+            return
+    duration = min(max(duration, 1), profiler.MAX_DURATION)
+    task = profiler.start(duration)
+    if task is None:
+        await update.message.reply_text("Профилирование уже запущено")
+        return
+    context.application.create_task(send_profile(task, context), update=update)
+    await update.message.reply_text(f"Профилирование запущено на {duration} с")
+
+
+async def send_profile(task: asyncio.Task, context: ContextTypes.DEFAULT_TYPE) -> None:
+    dump = await task
+    await context.bot.send_document(
+        chat_id=DEVELOPER_CHAT_ID,
+        document=dump.encode(),
+        filename=f"profile-{int(time.time())}.folded",
+        caption=(
+            f"Лаг event loop: последний {tracing.loop_lag['last']:.3f} с, "
+            f"максимальный {tracing.loop_lag['max']:.3f} с"
+        ),
+    )
+
+
 async def get_forum_topic_id(user: User, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Возвращает forum_topic_id. Если он не создан - создаёт"""
     message_thread_id = await database.find_message_thread_id_by_user_id(user.id)
@@ -156,81 +202,98 @@ async def forward_message_to_admins(
     reply_message_id: int | None = None,
 ) -> None:
     user = update.effective_user
-    message_thread_id = await get_message_thread_id_or_handle_exceptions(
-        update, context
-    )
+    with tracing.stage("get_forum_topic_id"):
+        message_thread_id = await get_message_thread_id_or_handle_exceptions(
+            update, context
+        )
     if message_thread_id is None:
         return
 
     reply_to_chat_message_id = None
     if reply_message_id:
-        reply_to_chat_message_id = (
-            await database.find_chat_message_id_by_message_id_and_user_id(
-                message_id=reply_message_id, user_id=user.id
+        with tracing.stage("find_reply"):
+            reply_to_chat_message_id = (
+                await database.find_chat_message_id_by_message_id_and_user_id(
+                    message_id=reply_message_id, user_id=user.id
+                )
             )
-        )
 
-    new_message = await update.message.copy(
-        chat_id=ADMIN_CHAT_ID,
-        message_thread_id=message_thread_id,
-        reply_to_message_id=reply_to_chat_message_id,
-    )
-    await database.create_message(
-        user_id=user.id,
-        message_id=update.message.message_id,
-        chat_message_id=new_message.message_id,
-        sender_type="user",
-    )
+    with tracing.stage("copy"):
+        new_message = await update.message.copy(
+            chat_id=ADMIN_CHAT_ID,
+            message_thread_id=message_thread_id,
+            reply_to_message_id=reply_to_chat_message_id,
+        )
+    with tracing.stage("create_message"):
+        await database.create_message(
+            user_id=user.id,
+            message_id=update.message.message_id,
+            chat_message_id=new_message.message_id,
+            sender_type="user",
+            update_id=update.update_id,
+        )
 
 
 async def forward_message_to_user(
     update: Update, message_thread_id: int, reply_message_id: int = None
 ) -> None:
-    user_id = await database.find_user_id_by_message_thread_id(
-        message_thread_id=message_thread_id
-    )
+    with tracing.stage("find_user_id"):
+        user_id = await database.find_user_id_by_message_thread_id(
+            message_thread_id=message_thread_id
+        )
     if user_id is None:
         await update.message.reply_text("Не найден пользователь этого форума")
         return
 
     reply_to_user_message_id = None
     if reply_message_id:
-        reply_to_user_message_id = (
-            await database.find_message_id_by_chat_message_id_and_message_thread_id(
-                chat_message_id=reply_message_id, message_thread_id=message_thread_id
+        with tracing.stage("find_reply"):
+            reply_to_user_message_id = (
+                await database.find_message_id_by_chat_message_id_and_message_thread_id(
+                    chat_message_id=reply_message_id,
+                    message_thread_id=message_thread_id,
+                )
             )
-        )
 
-    new_message = await update.message.copy(
-        chat_id=user_id, reply_to_message_id=reply_to_user_message_id
-    )
-    await database.create_message(
-        user_id=user_id,
-        message_id=new_message.message_id,
-        chat_message_id=update.message.message_id,
-        sender_type="staff",
-    )
+    with tracing.stage("copy"):
+        new_message = await update.message.copy(
+            chat_id=user_id, reply_to_message_id=reply_to_user_message_id
+        )
+    with tracing.stage("create_message"):
+        await database.create_message(
+            user_id=user_id,
+            message_id=new_message.message_id,
+            chat_message_id=update.message.message_id,
+            sender_type="staff",
+            update_id=update.update_id,
+        )
 
 
+@tracing.traced
 async def message_from_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     reply_message_id = (
         update.message.reply_to_message.message_id
         if update.message.reply_to_message
         else None
     )
-    try:
-        await forward_message_to_admins(update, context, reply_message_id)
-    except BadRequest as e:
-        if e.message == "Message thread not found":
-            # Тред удалён из чата, но не удалён из базы данных
-            await database.delete_user(update.effective_user.id)
-            await message_from_user(update, context)
-        elif e.message == "The message can't be copied":
+    for _ in range(THREAD_NOT_FOUND_RETRIES):
+        try:
+            await forward_message_to_admins(update, context, reply_message_id)
             return
-        else:
-            raise
+        except BadRequest as e:
+            if e.message == "Message thread not found":
+                # Тред удалён из чата, но не удалён из базы данных
+                await database.delete_user(update.effective_user.id)
+            elif e.message == "The message can't be copied":
+                return
+            else:
+                raise
+    logger.warning(
+        "Could not deliver message of user %s to a topic", update.effective_user.id
+    )
 
 
+@tracing.traced
 async def message_from_admin(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -254,37 +317,49 @@ async def message_from_admin(
 async def forward_edited_message_to_admins(
     update: Update, context: ContextTypes.DEFAULT_TYPE, original_message_id: int
 ) -> None:
-    message_thread_id = await get_message_thread_id_or_handle_exceptions(
-        update, context
-    )
+    with tracing.stage("get_forum_topic_id"):
+        message_thread_id = await get_message_thread_id_or_handle_exceptions(
+            update, context
+        )
     if message_thread_id is None:
         return
 
     user = update.effective_user
     original_message = update.edited_message
-    reply_to_chat_message_id = (
-        await database.find_chat_message_id_by_message_id_and_user_id(
-            message_id=original_message_id, user_id=user.id
+    with tracing.stage("find_reply"):
+        reply_to_chat_message_id = (
+            await database.find_chat_message_id_by_message_id_and_user_id(
+                message_id=original_message_id, user_id=user.id
+            )
         )
-    )
 
-    new_message = await original_message.copy(
-        chat_id=ADMIN_CHAT_ID,
-        message_thread_id=message_thread_id,
-        reply_to_message_id=reply_to_chat_message_id,
-        reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton(text="Обновлённое сообщение", callback_data="-1")]]
-        ),
-    )
+    with tracing.stage("copy"):
+        new_message = await original_message.copy(
+            chat_id=ADMIN_CHAT_ID,
+            message_thread_id=message_thread_id,
+            reply_to_message_id=reply_to_chat_message_id,
+            reply_markup=InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            text="Обновлённое сообщение", callback_data="-1"
+                        )
+                    ]
+                ]
+            ),
+        )
 
-    await database.create_message(
-        user_id=user.id,
-        message_id=original_message.message_id,
-        chat_message_id=new_message.message_id,
-        sender_type="user",
-    )
+    with tracing.stage("create_message"):
+        await database.create_message(
+            user_id=user.id,
+            message_id=original_message.message_id,
+            chat_message_id=new_message.message_id,
+            sender_type="user",
+            update_id=update.update_id,
+        )
 
 
+@tracing.traced
 async def edited_message_from_user(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -298,6 +373,7 @@ async def edited_message_from_user(
             raise
 
 
+@tracing.traced
 async def edited_message_from_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.edited_message.reply_text(
         "Редактировние текста не поддерживается, отправьте новое сообщение"
@@ -319,6 +395,7 @@ async def set_variant(number: int, update: Update, context: CallbackContext):
     )
 
 
+@tracing.traced
 async def handle_callback_query(update: Update, context: CallbackContext):
     query = update.callback_query
     if query is None:
@@ -330,6 +407,7 @@ async def handle_callback_query(update: Update, context: CallbackContext):
     await query.answer(text="")
 
 
+@tracing.traced
 async def set_prompt(update: Update, context: CallbackContext):
     await update.message.reply_text(
         "Выберите режим работы бота",
@@ -349,12 +427,19 @@ async def set_prompt(update: Update, context: CallbackContext):
 def main() -> None:
     loop = asyncio.get_event_loop()
     loop.run_until_complete(database.create_tables())
-    application = Application.builder().token(config["TELEGRAM_API_TOKEN"]).build()
+    application = (
+        Application.builder()
+        .token(config["TELEGRAM_API_TOKEN"])
+        .application_class(BoundedApplication)
+        .updater(None)
+        .build()
+    )
 
     application.add_handler(CommandHandler("set_text", set_text))
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help))
     application.add_handler(CommandHandler("set_prompt", set_prompt))
+    application.add_handler(CommandHandler("profile", profile))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
     application.add_handler(
         MessageHandler(
@@ -392,7 +477,14 @@ def main() -> None:
         )
     )
 
-    application.run_polling()
+    loop.run_until_complete(
+        journal.run(
+            application,
+            functools.partial(topics.reconcile_topics, application.bot, ADMIN_CHAT_ID),
+            tracing.monitor_loop_lag,
+            slow_update_threshold=SLOW_UPDATE_THRESHOLD,
+        )
+    )
 
 
 if __name__ == "__main__":
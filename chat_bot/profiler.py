@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+SAMPLE_INTERVAL = 0.005
+MAX_DURATION = 60
+
+_running = False
+
+
+def _fold(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_stacks(
+    thread_id: int, duration: float, interval: float = SAMPLE_INTERVAL
+) -> Counter:
+    """Снимает стек потока thread_id каждые interval секунд в течение duration
+    секунд. Запускается в отдельном потоке"""
+    samples: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        samples[_fold(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return samples
+
+
+def to_collapsed(samples: Counter) -> str:
+    """Формат collapsed stacks, который понимают flamegraph.pl и speedscope"""
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def start(duration: float) -> Optional[asyncio.Task]:
+    """Запускает профилирование потока event loop, не блокируя его. Задача
+    возвращает стеки в формате collapsed. Если профилирование уже идёт,
+    возвращает None"""
+    global _running
+    if _running:
+        return None
+    _running = True
+    return asyncio.create_task(_profile_event_loop(threading.get_ident(), duration))
+
+
+async def _profile_event_loop(thread_id: int, duration: float) -> str:
+    global _running
+    try:
+        samples = await asyncio.to_thread(sample_stacks, thread_id, duration)
+    finally:
+        _running = False
+    return to_collapsed(samples)
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, CallbackContext
+
+from chat_bot.context_store import BoundedApplication, BoundedStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_missing_key_uses_default_factory():
+    store = BoundedStore(dict, max_size=10, ttl=100)
+    store[1]["variant"] = 2
+    assert store[1] == {"variant": 2}
+
+
+def test_evicts_least_recently_used_over_max_size():
+    store = BoundedStore(dict, max_size=2, ttl=100)
+    store[1], store[2] = {}, {}
+    store[1]
+    store[3] = {}
+    assert list(store) == [1, 3]
+
+
+def test_evicts_idle_entries():
+    clock = FakeClock()
+    store = BoundedStore(dict, max_size=10, ttl=100, clock=clock)
+    store[1] = {}
+    clock.now = 50
+    store[2] = {}
+    clock.now = 120
+    store[3] = {}
+    assert list(store) == [2, 3]
+
+
+def make_update(user_id):
+    user = User(user_id, "user", False)
+    return Update(
+        user_id,
+        message=Message(1, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=user),
+    )
+
+
+def test_application_hands_out_bounded_user_data():
+    application = (
+        Application.builder()
+        .token("1111111111:AABBCCDDEEFFGGHHII")
+        .application_class(BoundedApplication, {"max_size": 1})
+        .updater(None)
+        .build()
+    )
+    assert isinstance(application, BoundedApplication)
+
+    context = CallbackContext.from_update(make_update(1), application)
+    context.user_data["key"] = "value"
+    assert application.user_data[1] is context.user_data
+    assert isinstance(application._user_data, BoundedStore)
+
+    CallbackContext.from_update(make_update(2), application).user_data
+    assert list(application.user_data) == [2]
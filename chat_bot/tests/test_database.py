@@ -128,3 +128,64 @@ async def test_update_text_value():
     await update_text("new_value_2")
     text_value = await get_text()
     assert text_value == "new_value_2"
+
+
+async def test_append_to_journal_ignores_duplicates():
+    await append_to_journal([(10, '{"update_id": 10}'), (11, '{"update_id": 11}')])
+    await append_to_journal([(11, '{"update_id": 11}'), (12, '{"update_id": 12}')])
+    entries = await find_pending_journal_entries()
+    assert [update_id for update_id, _ in entries] == [10, 11, 12]
+    assert await find_last_journal_update_id() == 12
+
+
+async def test_mark_journal_entry_processed():
+    await append_to_journal([(10, "{}"), (11, "{}")])
+    await mark_journal_entry_processed(10)
+    entries = await find_pending_journal_entries()
+    assert [update_id for update_id, _ in entries] == [11]
+
+
+async def test_create_message_marks_journal_entry_processed():
+    await append_to_journal([(10, "{}")])
+    user_id = await create_user(message_thread_id=1, user_id=123)
+    await create_message(
+        user_id=user_id,
+        message_id=111,
+        chat_message_id=222,
+        sender_type="user",
+        update_id=10,
+    )
+    assert await find_pending_journal_entries() == []
+
+
+async def test_prune_journal_keeps_last_entry():
+    await append_to_journal([(10, "{}"), (11, "{}"), (12, "{}")])
+    for update_id in (10, 11, 12):
+        await mark_journal_entry_processed(update_id)
+    await prune_journal()
+    assert await find_last_journal_update_id() == 12
+    async with AsyncSession(engine) as session:
+        result = await session.execute(select(JournalEntry.update_id))
+        assert result.scalars().all() == [12]
+
+
+async def test_find_users_page():
+    for user_id in (1, 2, 3):
+        await create_user(user_id=user_id, message_thread_id=user_id * 10)
+    assert await find_users_page(limit=2) == [(1, 10), (2, 20)]
+    assert await find_users_page(after_user_id=2, limit=2) == [(3, 30)]
+
+
+async def test_delete_user_missing():
+    await delete_user(user_id=123)
+    assert await find_message_thread_id_by_user_id(user_id=123) is None
+
+
+async def test_delete_user_if_thread_matches():
+    await create_user(user_id=123, message_thread_id=1)
+    assert (
+        await delete_user_if_thread_matches(user_id=123, message_thread_id=2) is False
+    )
+    assert await find_message_thread_id_by_user_id(user_id=123) == 1
+    assert await delete_user_if_thread_matches(user_id=123, message_thread_id=1) is True
+    assert await find_message_thread_id_by_user_id(user_id=123) is None
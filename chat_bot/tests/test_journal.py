@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import signal
+
+import pytest
+from telegram import Update
+
+from chat_bot import database, journal
+
+
+@pytest.fixture(autouse=True)
+async def setup_db_teardown():
+    await database.create_tables()
+    yield
+    await database.drop_tables()
+
+
+class StopPolling(Exception):
+    pass
+
+
+class StubBot:
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.offsets = []
+        self.journaled = []
+        self.allowed_updates = []
+
+    async def get_updates(self, offset, timeout, allowed_updates):
+        self.offsets.append(offset)
+        self.allowed_updates.append(allowed_updates)
+        self.journaled.append(await database.find_last_journal_update_id())
+        if not self.batches:
+            raise StopPolling()
+        return [Update(update_id) for update_id in self.batches.pop(0)]
+
+
+class StubApplication:
+    def __init__(self, bot=None, on_update=None):
+        self.bot = bot
+        self.on_update = on_update
+        self.processed = []
+        self.stopped = False
+
+    async def process_update(self, update):
+        self.processed.append(update.update_id)
+        if self.on_update is not None:
+            await self.on_update(update)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.stopped = True
+
+
+async def test_poll_updates_acknowledges_after_journaling():
+    await database.append_to_journal([(5, "{}")])
+    bot = StubBot([[6, 7], [8]])
+    new_updates = asyncio.Event()
+    with pytest.raises(StopPolling):
+        await journal.poll_updates(StubApplication(bot), new_updates)
+    assert bot.offsets == [6, 8, 9]
+    # Каждый следующий offset отправлен только когда предыдущие апдейты в журнале
+    assert bot.journaled == [5, 7, 8]
+    assert bot.allowed_updates == [None, None, None]
+    assert new_updates.is_set()
+
+
+async def test_poll_updates_does_not_acknowledge_on_journal_failure(monkeypatch):
+    async def failing_append(entries):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(database, "append_to_journal", failing_append)
+    bot = StubBot([[1]])
+    with pytest.raises(RuntimeError):
+        await journal.poll_updates(StubApplication(bot), asyncio.Event())
+    assert bot.offsets == [None]
+
+
+async def test_process_journal_replays_pending_in_order():
+    stop = asyncio.Event()
+
+    async def on_update(update):
+        if update.update_id == 12:
+            stop.set()
+
+    await database.append_to_journal(
+        [
+            (update_id, json.dumps({"update_id": update_id}))
+            for update_id in (12, 10, 11)
+        ]
+    )
+    user_id = await database.create_user(user_id=1, message_thread_id=1)
+    await database.create_message(
+        user_id=user_id,
+        message_id=1,
+        chat_message_id=1,
+        sender_type="user",
+        update_id=11,
+    )
+    application = StubApplication(on_update=on_update)
+    await journal.process_journal(application, asyncio.Event(), stop)
+    assert application.processed == [10, 12]
+    assert await database.find_pending_journal_entries() == []
+
+
+async def test_process_journal_marks_failed_update_processed():
+    stop = asyncio.Event()
+
+    async def on_update(update):
+        stop.set()
+        raise RuntimeError("handler failed")
+
+    await database.append_to_journal([(10, json.dumps({"update_id": 10}))])
+    application = StubApplication(on_update=on_update)
+    await journal.process_journal(application, asyncio.Event(), stop)
+    assert application.processed == [10]
+    assert await database.find_pending_journal_entries() == []
+
+
+async def test_supervise_restarts_crashed_task(monkeypatch):
+    monkeypatch.setattr(journal, "RESTART_DELAY", 0)
+    calls = []
+
+    async def task():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("crash")
+
+    await journal.supervise("task", task)
+    assert len(calls) == 3
+
+
+async def test_run_stops_on_sigterm(monkeypatch):
+    monkeypatch.setattr(journal, "RESTART_DELAY", 0)
+
+    async def on_update(update):
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    class IdleBot:
+        async def get_updates(self, offset, timeout, allowed_updates):
+            await asyncio.sleep(60)
+            return []
+
+    async def crashing_task():
+        raise RuntimeError("crash")
+
+    await database.append_to_journal(
+        [(update_id, json.dumps({"update_id": update_id})) for update_id in (1, 2)]
+    )
+    application = StubApplication(IdleBot(), on_update=on_update)
+    await asyncio.wait_for(journal.run(application, crashing_task), timeout=5)
+    assert application.processed == [1]
+    assert application.stopped
+    assert [
+        update_id for update_id, _ in await database.find_pending_journal_entries()
+    ] == [2]
@@ -0,0 +1,66 @@
+import importlib
+import io
+import json
+import sys
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from chat_bot import database
+
+CONFIG = {
+    "TELEGRAM_API_TOKEN": "1111111111:AABBCCDDEEFFGGHHII",
+    "ADMIN_CHAT_ID": -10011111111,
+    "DEVELOPER_CHAT_ID": 11111111,
+    "ADMIN_LIST": ["admin"],
+    "PROMPT": ["You are a helpful assistant"],
+}
+
+
+@pytest.fixture
+def main(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO(json.dumps(CONFIG)))
+    return importlib.import_module("chat_bot.main")
+
+
+@pytest.fixture(autouse=True)
+async def setup_db_teardown():
+    await database.create_tables()
+    yield
+    await database.drop_tables()
+
+
+def make_update(user_id):
+    return SimpleNamespace(
+        message=SimpleNamespace(reply_to_message=None),
+        effective_user=SimpleNamespace(id=user_id),
+    )
+
+
+async def test_message_from_user_retries_are_bounded(main, monkeypatch):
+    calls = []
+
+    async def forward_message_to_admins(update, context, reply_message_id):
+        calls.append(reply_message_id)
+        raise BadRequest("Message thread not found")
+
+    monkeypatch.setattr(main, "forward_message_to_admins", forward_message_to_admins)
+    await database.create_user(user_id=1, message_thread_id=10)
+    await main.message_from_user(make_update(1), None)
+    assert len(calls) == main.THREAD_NOT_FOUND_RETRIES
+    assert await database.find_message_thread_id_by_user_id(1) is None
+
+
+async def test_message_from_user_recovers_after_thread_not_found(main, monkeypatch):
+    calls = []
+
+    async def forward_message_to_admins(update, context, reply_message_id):
+        calls.append(reply_message_id)
+        if len(calls) == 1:
+            raise BadRequest("Message thread not found")
+
+    monkeypatch.setattr(main, "forward_message_to_admins", forward_message_to_admins)
+    await database.create_user(user_id=1, message_thread_id=10)
+    await main.message_from_user(make_update(1), None)
+    assert len(calls) == 2
@@ -0,0 +1,82 @@
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from chat_bot import database, topics
+
+
+@pytest.fixture(autouse=True)
+async def setup_db_teardown():
+    await database.create_tables()
+    yield
+    await database.drop_tables()
+
+
+class StubBot:
+    def __init__(self, missing_threads=(), on_check=None, rate_limited=()):
+        self.missing_threads = set(missing_threads)
+        self.on_check = on_check
+        self.rate_limited = set(rate_limited)
+        self.checked = []
+
+    async def send_chat_action(self, chat_id, action, message_thread_id):
+        self.checked.append(message_thread_id)
+        if message_thread_id in self.rate_limited:
+            self.rate_limited.remove(message_thread_id)
+            raise RetryAfter(0)
+        if self.on_check is not None:
+            await self.on_check(message_thread_id)
+        if message_thread_id in self.missing_threads:
+            raise BadRequest("Message thread not found")
+        return True
+
+
+async def test_validate_topic_drops_missing_thread():
+    await database.create_user(user_id=1, message_thread_id=10)
+    bot = StubBot(missing_threads={10})
+    assert await topics.validate_topic(bot, -100, 1, 10) is False
+    assert await database.find_message_thread_id_by_user_id(1) is None
+
+
+async def test_validate_topic_keeps_existing_thread():
+    await database.create_user(user_id=1, message_thread_id=10)
+    assert await topics.validate_topic(StubBot(), -100, 1, 10) is True
+    assert await database.find_message_thread_id_by_user_id(1) == 10
+
+
+async def test_validate_topic_keeps_concurrent_remapping():
+    await database.create_user(user_id=1, message_thread_id=10)
+
+    async def remap(message_thread_id):
+        # Пока идёт проверка, message_from_user пересоздал топик
+        await database.delete_user(1)
+        await database.create_user(user_id=1, message_thread_id=20)
+
+    bot = StubBot(missing_threads={10}, on_check=remap)
+    assert await topics.validate_topic(bot, -100, 1, 10) is False
+    assert await database.find_message_thread_id_by_user_id(1) == 20
+
+
+async def test_validate_topic_with_already_deleted_user():
+    bot = StubBot(missing_threads={10})
+    assert await topics.validate_topic(bot, -100, 1, 10) is False
+
+
+async def test_reconcile_round_walks_all_pages(monkeypatch):
+    monkeypatch.setattr(topics, "BATCH_SIZE", 2)
+    monkeypatch.setattr(topics, "CHECK_DELAY", 0)
+    for user_id in (1, 2, 3, 4, 5):
+        await database.create_user(user_id=user_id, message_thread_id=user_id * 10)
+    bot = StubBot(missing_threads={20, 50})
+    await topics.reconcile_round(bot, -100)
+    assert bot.checked == [10, 20, 30, 40, 50]
+    assert await database.find_users_page() == [(1, 10), (3, 30), (4, 40)]
+
+
+async def test_reconcile_round_retries_rate_limited_topic(monkeypatch):
+    monkeypatch.setattr(topics, "CHECK_DELAY", 0)
+    for user_id in (1, 2):
+        await database.create_user(user_id=user_id, message_thread_id=user_id * 10)
+    bot = StubBot(missing_threads={10}, rate_limited={10})
+    await topics.reconcile_round(bot, -100)
+    assert bot.checked == [10, 10, 20]
+    assert await database.find_users_page() == [(2, 20)]
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import logging
+import threading
+
+from chat_bot import profiler, tracing
+
+
+async def test_trace_update_logs_slow_update(caplog):
+    @tracing.traced
+    async def handler():
+        with tracing.stage("copy"):
+            await asyncio.sleep(0.01)
+        with tracing.stage("copy"):
+            pass
+
+    with caplog.at_level(logging.WARNING, logger="chat_bot.slow_updates"):
+        with tracing.trace_update(42, threshold=0):
+            await handler()
+
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["update_id"] == 42
+    assert record["handler"] == "handler"
+    assert set(record["stages"]) == {"copy"}
+    assert record["stages"]["copy"] >= 0.01
+
+
+async def test_trace_update_skips_fast_update(caplog):
+    with caplog.at_level(logging.WARNING, logger="chat_bot.slow_updates"):
+        with tracing.trace_update(42, threshold=60):
+            with tracing.stage("copy"):
+                pass
+    assert caplog.records == []
+
+
+def test_stage_without_trace():
+    with tracing.stage("copy"):
+        pass
+    assert tracing.current_trace.get() is None
+
+
+def test_sample_stacks_collapsed_format():
+    samples = profiler.sample_stacks(
+        threading.get_ident(), duration=0.02, interval=0.001
+    )
+    dump = profiler.to_collapsed(samples)
+    stack, count = dump.splitlines()[0].rsplit(" ", 1)
+    assert "sample_stacks (profiler.py)" in stack
+    assert int(count) > 0
+
+
+async def test_profiler_rejects_concurrent_start():
+    task = profiler.start(0.02)
+    assert task is not None
+    assert profiler.start(0.02) is None
+    dump = await task
+    assert dump
+    second = profiler.start(0.01)
+    assert second is not None
+    await second
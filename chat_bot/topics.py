@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+from telegram import Bot
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from chat_bot import database
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+# Проверка - это sendChatAction, поэтому персонал видит в топике "печатает..."
+# до 5 секунд. Незаметной проверки в Bot API нет, поэтому проход медленный и
+# редкий: при 300 000 пользователей он идёт около 3,5 суток (по секунде на
+# пользователя), а следующий начинается через сутки, то есть каждый топик
+# мелькает примерно раз в 4,5 дня. Топик, удалённый между проходами, всё
+# равно восстановит повтор в message_from_user.
+CHECK_DELAY = 1
+ROUND_DELAY = 24 * 60 * 60
+
+
+async def validate_topic(
+    bot: Bot, admin_chat_id: int, user_id: int, message_thread_id: int
+) -> bool:
+    """Проверяет, что топик пользователя существует. Если он удалён - удаляет
+    пользователя из базы, чтобы следующее сообщение создало новый топик.
+    Если пользователя тем временем привязали к другому топику, его не трогает"""
+    try:
+        await bot.send_chat_action(
+            admin_chat_id, ChatAction.TYPING, message_thread_id=message_thread_id
+        )
+    except BadRequest as e:
+        if e.message != "Message thread not found":
+            raise
+        logger.info("Topic %s of user %s is gone", message_thread_id, user_id)
+        await database.delete_user_if_thread_matches(user_id, message_thread_id)
+        return False
+    return True
+
+
+async def reconcile_round(bot: Bot, admin_chat_id: int) -> None:
+    """Один проход по всем users.message_thread_id пачками по BATCH_SIZE"""
+    after_user_id = None
+    while True:
+        users = await database.find_users_page(
+            after_user_id=after_user_id, limit=BATCH_SIZE
+        )
+        for user_id, message_thread_id in users:
+            while True:
+                try:
+                    await validate_topic(bot, admin_chat_id, user_id, message_thread_id)
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except TelegramError as e:
+                    logger.warning("Failed to validate topic of %s: %s", user_id, e)
+                break
+            await asyncio.sleep(CHECK_DELAY)
+        if len(users) < BATCH_SIZE:
+            return
+        after_user_id = users[-1][0]
+
+
+async def reconcile_topics(bot: Bot, admin_chat_id: int) -> None:
+    """Фоновая задача: раз в ROUND_DELAY проверяет все топики пользователей"""
+    while True:
+        await reconcile_round(bot, admin_chat_id)
+        await asyncio.sleep(ROUND_DELAY)
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+slow_update_logger = logging.getLogger("chat_bot.slow_updates")
+
+SLOW_UPDATE_THRESHOLD = 1.0
+LOOP_LAG_INTERVAL = 1.0
+LOOP_LAG_THRESHOLD = 0.5
+
+
+class Trace:
+    """Время, потраченное на этапы обработки одного апдейта"""
+
+    __slots__ = ("update_id", "handler", "stages", "started")
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+        self.handler: Optional[str] = None
+        self.stages: dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def to_dict(self, total: float) -> dict:
+        return {
+            "update_id": self.update_id,
+            "handler": self.handler,
+            "total": round(total, 4),
+            "stages": {name: round(value, 4) for name, value in self.stages.items()},
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+loop_lag = {"last": 0.0, "max": 0.0}
+
+
+@contextmanager
+def trace_update(
+    update_id: int, threshold: float = SLOW_UPDATE_THRESHOLD
+) -> Iterator[Trace]:
+    """Трассирует обработку апдейта и пишет её в лог медленных апдейтов,
+    если она заняла больше threshold секунд"""
+    trace = Trace(update_id)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        total = time.perf_counter() - trace.started
+        if total >= threshold:
+            slow_update_logger.warning(json.dumps(trace.to_dict(total)))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замеряет этап обработки текущего апдейта"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.stages[name] = trace.stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def traced(callback):
+    """Записывает в текущую трассировку, какой хендлер обработал апдейт"""
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        trace = current_trace.get()
+        if trace is not None and trace.handler is None:
+            trace.handler = callback.__name__
+        return await callback(*args, **kwargs)
+
+    return wrapper
+
+
+async def monitor_loop_lag(
+    interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD
+) -> None:
+    """Фоновая задача: замеряет, насколько позже положенного просыпается
+    event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        loop_lag["last"] = lag
+        loop_lag["max"] = max(loop_lag["max"], lag)
+        if lag >= threshold:
+            logger.warning("Event loop lag %.3fs", lag)